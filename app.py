@@ -1,14 +1,25 @@
 # app.py
 
+import atexit
+import hashlib
 import joblib
 import pandas as pd
+import signal
 import sqlite3
+import sys
+import threading
 import jwt
 import datetime
+import time
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, request, jsonify, render_template, make_response
+from flask import Flask, Response, g, request, jsonify, render_template, make_response
 from flask_cors import CORS
-from fpdf import FPDF
+from metrics import REGISTRY, StageTimer
+from profiling import profiled
+from audit import AuditLog
+from reports import render_report, report_jobs, iter_zip, REPORT_MAX_BATCH
 from io import BytesIO 
 
 SECRET_KEY = "supersecretkey"  # Change this in production! 
@@ -19,6 +30,9 @@ try:
     model = joblib.load("gastric_detection_model.joblib")
     with open("gastric_detection_features.txt", "r") as f:
         MODEL_FEATURES = [line.strip() for line in f]
+    # Content hash of the model file, recorded with every audited prediction
+    with open("gastric_detection_model.joblib", "rb") as f:
+        MODEL_VERSION = hashlib.sha256(f.read()).hexdigest()[:12]
 except FileNotFoundError:
     print("FATAL ERROR: Detection model or feature file not found. Run 'train_and_save.py' first.")
     # exit() # Allow running even if model is missing for dev purposes
@@ -36,6 +50,20 @@ def init_db():
 
 init_db()
 
+# Prediction audit trail, written in batches off the request thread. Opened
+# on first use so importing the app does not create audit.db or start the
+# writer thread.
+audit_log = None
+_audit_log_lock = threading.Lock()
+
+def get_audit_log():
+    global audit_log
+    with _audit_log_lock:
+        if audit_log is None:
+            audit_log = AuditLog()
+            atexit.register(audit_log.close)
+        return audit_log
+
 app = Flask(__name__, template_folder="templates")
 CORS(app)
 
@@ -57,6 +85,38 @@ NUMERIC_COLS = [
 ]
 
 
+# --- Metrics ---
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    REGISTRY.request_started(g.metrics_route)
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_start' not in g:
+        return
+    status = g.get('metrics_status', 500)
+    REGISTRY.request_finished(
+        g.metrics_route,
+        request.method,
+        status,
+        time.perf_counter() - g.metrics_start,
+        error=exc is not None or status >= 500,
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 # --- Routes ---
 
 # DB Migration for Surname
@@ -102,13 +162,38 @@ def signup_api():
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }, SECRET_KEY, algorithm="HS256")
 
-        return jsonify({'token': token, 'user': {'name': f"{name} {surname}".strip(), 'email': email}})
+        resp = jsonify({'token': token, 'user': {'name': f"{name} {surname}".strip(), 'email': email}})
+        set_token_cookie(resp, token)
+        return resp
 
     except sqlite3.IntegrityError:
         return jsonify({'message': 'User already exists'}), 409
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+def set_token_cookie(resp, token):
+    """Stores the login token in a cookie for the server-rendered pages.
+
+    The React app keeps its token in localStorage on its own origin, which the
+    Flask pages cannot read; cookies are shared across ports on the same host.
+    """
+    resp.set_cookie('token', token, max_age=24 * 3600, httponly=True, samesite='Lax')
+
+def token_user():
+    """Returns the user from a valid ``Authorization: Bearer`` token or token
+    cookie, or None."""
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        token = auth[len('Bearer '):]
+    else:
+        token = request.cookies.get('token')
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get('user')
+    except jwt.InvalidTokenError:
+        return None
+
 @app.route('/api/auth/login', methods=['POST'])
 def login_api():
     data = request.json
@@ -141,10 +226,19 @@ def login_api():
             
         full_name = f"{user[1]} {surname}".strip()
         
-        return jsonify({'token': token, 'user': {'name': full_name, 'email': email}})
+        resp = jsonify({'token': token, 'user': {'name': full_name, 'email': email}})
+        set_token_cookie(resp, token)
+        return resp
     
     return jsonify({'message': 'Invalid credentials'}), 401
 
+@app.route('/api/auth/logout', methods=['POST'])
+def logout_api():
+    """Clears the token cookie; the client discards its own copy of the token."""
+    resp = jsonify({'message': 'Logged out'})
+    resp.delete_cookie('token')
+    return resp
+
 @app.route('/')
 def root():
     """Redirect root to home page."""
@@ -187,119 +281,80 @@ def download_report():
     if not data:
         return jsonify({'message': 'No data provided'}), 400
 
-    # Extract data
-    risk_level = data.get('risk_level', 'Unknown').upper()
-    probability = data.get('probability_of_cancer', 0)
-    drivers = data.get('risk_drivers', [])
-    recommendations = data.get('recommendations', [])
-    date_str = data.get('date', datetime.datetime.now().strftime("%Y-%m-%d"))
-    prob_percent = f"{float(probability) * 100:.2f}%"
-    patient_name = data.get('patient_name', 'Guest').encode('latin-1', 'replace').decode('latin-1')
-
-    # Create PDF
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Title
-    pdf.set_font("Arial", 'B', 24)
-    pdf.cell(0, 15, "Clinical Assessment Report", ln=True, align='C')
-    pdf.set_font("Arial", '', 12)
-    pdf.cell(0, 8, "Gastric Cancer Risk Estimation System", ln=True, align='C')
-    pdf.cell(0, 8, f"Date: {date_str}", ln=True, align='C')
-    pdf.cell(0, 8, f"Patient Name: {patient_name}", ln=True, align='C')
-    pdf.ln(10)
-
-    # Risk Profile
-    pdf.set_fill_color(245, 245, 245)
-    pdf.rect(10, pdf.get_y(), 190, 40, 'F')
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, "Risk Profile", ln=True)
-    pdf.ln(5)
-
-    pdf.set_font("Arial", '', 12)
-    current_y = pdf.get_y()
-    
-    # Analysis Result
-    pdf.set_xy(30, current_y)
-    pdf.cell(60, 6, "Analysis Result", ln=True, align='C')
-    pdf.set_font("Arial", 'B', 20)
-    
-    # Color logic isn't supported directly in cell text easily without multi-cell, 
-    # but we can set text color.
-    if risk_level == 'HIGH':
-        pdf.set_text_color(211, 47, 47) # Red
-    elif risk_level == 'MODERATE':
-        pdf.set_text_color(239, 108, 0) # Orange
-    else:
-        pdf.set_text_color(46, 125, 50) # Green
-        
-    pdf.set_xy(30, current_y + 8)
-    pdf.cell(60, 10, f"{risk_level} RISK", ln=True, align='C')
-    pdf.set_text_color(0, 0, 0) # Reset
-
-    # Probability
-    pdf.set_xy(120, current_y)
-    pdf.set_font("Arial", '', 12)
-    pdf.cell(60, 6, "Estimated Probability", ln=True, align='C')
-    pdf.set_font("Arial", 'B', 20)
-    pdf.set_xy(120, current_y + 8)
-    pdf.cell(60, 10, prob_percent, ln=True, align='C')
-    
-    pdf.ln(20)
-
-    # Top Risk Drivers
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Top Risk Drivers", ln=True)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(5)
-
-    pdf.set_font("Arial", '', 12)
-    if drivers:
-        for driver in drivers:
-            name = driver.get('name', '').encode('latin-1', 'replace').decode('latin-1')
-            impact = driver.get('impact', '').encode('latin-1', 'replace').decode('latin-1')
-            pdf.set_font("Arial", 'B', 12)
-            pdf.write(5, f"- {name}")
-            pdf.set_font("Arial", '', 11)
-            pdf.write(5, f" ({impact} Impact)")
-            pdf.ln(8)
-    else:
-        pdf.cell(0, 10, "No specific major risk drivers identified.", ln=True)
-    
-    pdf.ln(10)
-
-    # Recommendations
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Recommended Next Steps", ln=True)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(5)
-
-    pdf.set_font("Arial", '', 12)
-    if recommendations:
-        for step in recommendations:
-            step_clean = step.encode('latin-1', 'replace').decode('latin-1')
-            pdf.write(5, f"- {step_clean}")
-            pdf.ln(8)
-    else:
-        pdf.cell(0, 10, "Consult a healthcare provider.", ln=True)
-
-    # Disclaimer
-    pdf.ln(20)
-    pdf.set_font("Arial", 'I', 10)
-    pdf.set_text_color(100, 100, 100)
-    pdf.multi_cell(0, 5, "DISCLAIMER: This report is generated by an AI Support Tool. It is NOT a definitive medical diagnosis. Please consult a qualified doctor for interpretation and clinical decisions.", align='C')
-
-    # Output - FPDF classic way
-    # dest='S' returns the document as a string.
-    # We strip spaces as a safety precaution though strictly not needed for S.
-    response_string = pdf.output(dest='S')
-    
-    # Encode to bytes for Flask response
-    response_bytes = response_string.encode('latin-1')
+    filename, pdf_bytes = render_report(data, StageTimer('/api/download_report'))
 
-    return make_response(response_bytes, 200, {
+    return make_response(pdf_bytes, 200, {
         'Content-Type': 'application/pdf',
-        'Content-Disposition': f'attachment; filename=Gastric_Risk_Report_{date_str}.pdf'
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+# --- Report Jobs ---
+
+@app.route('/api/reports/jobs', methods=['POST'])
+def submit_report_job():
+    """Queues one or many report payloads for background rendering.
+
+    Accepts a single report payload, a list of payloads, or
+    ``{"reports": [...]}``. Returns the job id to poll.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and 'reports' in data:
+        payloads = data['reports']
+    elif isinstance(data, dict):
+        payloads = [data]
+    else:
+        payloads = data
+
+    if not payloads or not isinstance(payloads, list) or not all(isinstance(p, dict) and p for p in payloads):
+        return jsonify({'message': 'No data provided'}), 400
+    if len(payloads) > REPORT_MAX_BATCH:
+        return jsonify({'message': f'At most {REPORT_MAX_BATCH} reports per job'}), 413
+
+    try:
+        job_id = report_jobs.submit(payloads)
+    except OverflowError as e:
+        return jsonify({'message': str(e)}), 503
+    except BrokenProcessPool:
+        return jsonify({'message': 'Report workers are unavailable, please retry.'}), 503
+
+    return jsonify(report_jobs.status(job_id)), 202
+
+@app.route('/api/reports/jobs/<job_id>', methods=['GET'])
+def report_job_status(job_id):
+    """Returns the progress of a report job."""
+    status = report_jobs.status(job_id)
+    if status is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/reports/jobs/<job_id>/download', methods=['GET'])
+def download_report_job(job_id):
+    """Downloads a finished job: a PDF for single reports, otherwise a streamed ZIP."""
+    status = report_jobs.status(job_id)
+    if status is None:
+        return jsonify({'message': 'Job not found'}), 404
+    if status['status'] in ('queued', 'running'):
+        return jsonify(status), 409
+
+    reports = report_jobs.results(job_id)
+    if not any(reports):
+        return jsonify(status), 500
+
+    if status['total'] == 1:
+        filename, pdf_bytes = reports[0]
+        return make_response(pdf_bytes, 200, {
+            'Content-Type': 'application/pdf',
+            'Content-Disposition': f'attachment; filename={filename}'
+        })
+
+    # Reports often share a date-based filename, so prefix each with its position
+    entries = (
+        (f"{i:04d}_{report[0]}", report[1])
+        for i, report in enumerate(reports, 1) if report is not None
+    )
+    return Response(iter_zip(entries), 200, {
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename=Gastric_Risk_Reports_{job_id}.zip'
     })
 
 # --- Chatbot Logic ---
@@ -339,6 +394,7 @@ def load_pdf_content():
 load_pdf_content()
 
 @app.route('/api/chat', methods=['POST'])
+@profiled
 def chat_api():
     data = request.json
     user_query = data.get('message', '')
@@ -348,10 +404,13 @@ def chat_api():
 
     try:
         # Transform query and find best match
+        timer = StageTimer('/api/chat')
         query_vec = VECTORIZER.transform([user_query])
+        timer.mark("transform")
         similarities = cosine_similarity(query_vec, TFIDF_MATRIX).flatten()
         best_idx = similarities.argmax()
         best_score = similarities[best_idx]
+        timer.mark("similarity")
         
         if best_score > 0.1: # Threshold for relevance
             response = PDF_CONTENT[best_idx]
@@ -363,219 +422,459 @@ def chat_api():
         print(f"Chatbot Query Error: {e}")
         return jsonify({'response': "Sorry, I ran into an error processing your question."})
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    """Handles the prediction request."""
-    try:
-        data = request.get_json(force=True) or {}
+# --- Risk Scoring ---
 
-        # 1. Build a single-row DataFrame with expected columns
-        all_cols = NUMERIC_COLS + CATEGORICAL_COLS
-        row = {}
-        for col in all_cols:
-            value = data.get(col, None)
-            row[col] = value
+def build_input_frame(raw_df):
+    """Selects the model input columns from ``raw_df`` and imputes missing values."""
+    input_df = raw_df.reindex(columns=NUMERIC_COLS + CATEGORICAL_COLS)
 
-        input_df = pd.DataFrame([row])
+    # Simple imputation to avoid failures on missing values. Each row is
+    # imputed on its own (a missing number becomes 0), as /predict always has.
+    for col in NUMERIC_COLS:
+        input_df[col] = pd.to_numeric(input_df[col], errors="coerce").fillna(0)
 
-        # 2. Simple imputation to avoid failures on missing values
-        for col in NUMERIC_COLS:
-            if col in input_df.columns:
-                input_df[col] = pd.to_numeric(input_df[col], errors="coerce")
-                median_val = input_df[col].median() if not pd.isna(input_df[col].median()) else 0
-                input_df[col] = input_df[col].fillna(median_val)
+    for col in CATEGORICAL_COLS:
+        input_df[col] = input_df[col].fillna("Unknown")
 
-        for col in CATEGORICAL_COLS:
-            if col in input_df.columns:
-                input_df[col] = input_df[col].fillna("Unknown")
+    return input_df
 
-        # 3. One-Hot Encode categorical variables (same as training)
-        input_encoded = pd.get_dummies(input_df, columns=CATEGORICAL_COLS, drop_first=True)
 
-        # 4. Align features with the training data
-        final_input = input_encoded.reindex(columns=MODEL_FEATURES, fill_value=0)
-
-        # 5. Make prediction – probability of gastric cancer (label = 1)
-        prob_cancer = float(model.predict_proba(final_input)[:, 1][0])
-
-        # 5a. Extract individual risk factors for balanced assessment
-        row_clean = final_input.copy()
-        # Work from original (pre-encoded) input_df for interpretability
-        fh = int(round(float(input_df.get("family_history", 0).iloc[0] or 0)))
-        hp = int(round(float(input_df.get("helicobacter_pylori_infection", 0).iloc[0] or 0)))
-        smoke = int(round(float(input_df.get("smoking_habits", 0).iloc[0] or 0)))
-        diet = str(input_df.get("dietary_habits", pd.Series(["Low_Salt"])).iloc[0] or "Low_Salt")
-        cond = str(input_df.get("existing_conditions", pd.Series(["None"])).iloc[0] or "None")
-
-        # Individual risk factor flags
-        has_family_history = fh == 1
-        has_h_pylori = hp == 1
-        has_smoking = smoke == 1
-        has_high_salt = diet == "High_Salt"
-        has_chronic_gastritis = cond == "Chronic Gastritis"
-        
-        major_flags = [
-            has_family_history,
-            has_h_pylori,
-            has_high_salt,
-            has_chronic_gastritis,
-            has_smoking,
-        ]
-        n_major = sum(major_flags)
-
-        # 6. Convert probability into risk tier (initial assessment)
-        if prob_cancer < 0.3:
-            risk_level = "low"
-            risk_text = "Low estimated chance of gastric cancer based on your answers."
-        elif prob_cancer < 0.6:
-            risk_level = "moderate"
-            risk_text = "Moderate (borderline) risk – you should consider consulting a doctor for proper evaluation."
-        else:
-            risk_level = "high"
-            risk_text = "High estimated chance – you should consult a doctor or gastroenterologist as soon as possible."
-
-        # 6a. Rule: If there are NO major risk factors (only age/gender), cap risk at low
-        if n_major == 0 and risk_level in ["moderate", "high"]:
+def encode_features(input_df):
+    """One-hot encodes ``input_df`` and aligns it with the training features."""
+    if len(input_df) == 1:
+        # One-Hot Encode categorical variables (same as training)
+        input_encoded = pd.get_dummies(input_df, columns=CATEGORICAL_COLS, drop_first=True)
+    else:
+        # drop_first=True drops every level of a single-row frame, so a lone
+        # /predict row only ever carries its numeric columns. Batches are
+        # encoded the same way so their scores match per-request scores.
+        input_encoded = input_df[NUMERIC_COLS]
+
+    return input_encoded.reindex(columns=MODEL_FEATURES, fill_value=0)
+
+
+def assess_risk(prob_cancer, row, timer=None):
+    """Applies the clinical rules to a model probability for one input row.
+
+    ``row`` is a dict of imputed (pre-encoded) inputs. Returns the risk tier,
+    message, top risk drivers and recommended next steps. ``timer`` is an
+    optional StageTimer that records the rules and drivers stages.
+    """
+    # 5a. Extract individual risk factors for balanced assessment
+    # Work from original (pre-encoded) input row for interpretability
+    fh = int(round(float(row.get("family_history", 0) or 0)))
+    hp = int(round(float(row.get("helicobacter_pylori_infection", 0) or 0)))
+    smoke = int(round(float(row.get("smoking_habits", 0) or 0)))
+    diet = str(row.get("dietary_habits", "Low_Salt") or "Low_Salt")
+    cond = str(row.get("existing_conditions", "None") or "None")
+
+    # Individual risk factor flags
+    has_family_history = fh == 1
+    has_h_pylori = hp == 1
+    has_smoking = smoke == 1
+    has_high_salt = diet == "High_Salt"
+    has_chronic_gastritis = cond == "Chronic Gastritis"
+
+    major_flags = [
+        has_family_history,
+        has_h_pylori,
+        has_high_salt,
+        has_chronic_gastritis,
+        has_smoking,
+    ]
+    n_major = sum(major_flags)
+
+    # 6. Convert probability into risk tier (initial assessment)
+    if prob_cancer < 0.3:
+        risk_level = "low"
+        risk_text = "Low estimated chance of gastric cancer based on your answers."
+    elif prob_cancer < 0.6:
+        risk_level = "moderate"
+        risk_text = "Moderate (borderline) risk – you should consider consulting a doctor for proper evaluation."
+    else:
+        risk_level = "high"
+        risk_text = "High estimated chance – you should consult a doctor or gastroenterologist as soon as possible."
+
+    # 6a. Rule: If there are NO major risk factors (only age/gender), cap risk at low
+    if n_major == 0 and risk_level in ["moderate", "high"]:
+        risk_level = "low"
+        if prob_cancer >= 0.3:
+            prob_cancer = 0.25  # Set to low risk range
+        risk_text = (
+            "Low estimated chance of gastric cancer based on your answers. "
+            "You have no major risk factors present. However, regular health checkups are always recommended."
+        )
+
+    # 6b. Rule: If ONLY family history is present (no other risk factors), cap at low
+    # Family history alone is not strong enough to warrant moderate risk
+    if n_major == 1 and has_family_history and not (has_h_pylori or has_smoking or has_high_salt or has_chronic_gastritis):
+        if risk_level in ["moderate", "high"]:
             risk_level = "low"
             if prob_cancer >= 0.3:
-                prob_cancer = 0.25  # Set to low risk range
+                prob_cancer = 0.28  # Set to low risk range
             risk_text = (
                 "Low estimated chance of gastric cancer based on your answers. "
-                "You have no major risk factors present. However, regular health checkups are always recommended."
+                "While you have a family history, you have no other major risk factors present. "
+                "Regular health checkups and monitoring are recommended."
             )
 
-        # 6b. Rule: If ONLY family history is present (no other risk factors), cap at low
-        # Family history alone is not strong enough to warrant moderate risk
-        if n_major == 1 and has_family_history and not (has_h_pylori or has_smoking or has_high_salt or has_chronic_gastritis):
-            if risk_level in ["moderate", "high"]:
-                risk_level = "low"
-                if prob_cancer >= 0.3:
-                    prob_cancer = 0.28  # Set to low risk range
-                risk_text = (
-                    "Low estimated chance of gastric cancer based on your answers. "
-                    "While you have a family history, you have no other major risk factors present. "
-                    "Regular health checkups and monitoring are recommended."
-                )
-
-        # 6c. Rule: Positive helicobacter pylori infection should result in at least moderate risk
-        # H. pylori is a strong independent risk factor
-        if has_h_pylori and risk_level == "low":
+    # 6c. Rule: Positive helicobacter pylori infection should result in at least moderate risk
+    # H. pylori is a strong independent risk factor
+    if has_h_pylori and risk_level == "low":
+        risk_level = "moderate"
+        if prob_cancer < 0.3:
+            prob_cancer = 0.35  # Set to moderate range
+        risk_text = (
+            "Moderate risk – Helicobacter pylori infection is a significant risk factor for gastric cancer. "
+            "You should consider consulting a doctor for proper evaluation and potential treatment."
+        )
+
+    # 6d. Rule: Chronic gastritis alone should result in at least moderate risk
+    # Chronic gastritis is a medical condition that requires attention
+    if n_major == 1 and has_chronic_gastritis and not (has_family_history or has_h_pylori or has_smoking or has_high_salt):
+        if risk_level == "low":
             risk_level = "moderate"
             if prob_cancer < 0.3:
-                prob_cancer = 0.35  # Set to moderate range
+                prob_cancer = 0.35
             risk_text = (
-                "Moderate risk – Helicobacter pylori infection is a significant risk factor for gastric cancer. "
-                "You should consider consulting a doctor for proper evaluation and potential treatment."
+                "Moderate risk – Chronic gastritis is a condition that requires medical attention. "
+                "You should consult a doctor for proper evaluation and management."
             )
 
-        # 6d. Rule: Chronic gastritis alone should result in at least moderate risk
-        # Chronic gastritis is a medical condition that requires attention
-        if n_major == 1 and has_chronic_gastritis and not (has_family_history or has_h_pylori or has_smoking or has_high_salt):
-            if risk_level == "low":
-                risk_level = "moderate"
-                if prob_cancer < 0.3:
-                    prob_cancer = 0.35
-                risk_text = (
-                    "Moderate risk – Chronic gastritis is a condition that requires medical attention. "
-                    "You should consult a doctor for proper evaluation and management."
-                )
-
-        # 6e. Rule: If only one weak risk factor (smoking or high salt diet alone), cap at low
-        # These factors alone are not strong enough for moderate risk
-        if n_major == 1 and (has_smoking or has_high_salt) and not (has_family_history or has_h_pylori or has_chronic_gastritis):
-            if risk_level in ["moderate", "high"]:
-                risk_level = "low"
-                if prob_cancer >= 0.3:
-                    prob_cancer = 0.28
-                risk_text = (
-                    "Low estimated chance of gastric cancer based on your answers. "
-                    "While you have one risk factor present, it alone is not sufficient for elevated risk. "
-                    "However, reducing this risk factor and regular health checkups are recommended."
-                )
-
-        # 6f. Safety rule: if there is only 1 major risk factor (and it's not H. pylori or chronic gastritis),
-        # do NOT allow the final tier to be "high". At most moderate.
-        if n_major == 1 and risk_level == "high" and not (has_h_pylori or has_chronic_gastritis):
-            risk_level = "moderate"
-            if prob_cancer > 0.59:
-                prob_cancer = 0.59
+    # 6e. Rule: If only one weak risk factor (smoking or high salt diet alone), cap at low
+    # These factors alone are not strong enough for moderate risk
+    if n_major == 1 and (has_smoking or has_high_salt) and not (has_family_history or has_h_pylori or has_chronic_gastritis):
+        if risk_level in ["moderate", "high"]:
+            risk_level = "low"
+            if prob_cancer >= 0.3:
+                prob_cancer = 0.28
             risk_text = (
-                "Moderate (borderline) risk – only one major risk factor was present. "
-                "You may still wish to discuss this with a doctor, especially if symptoms persist."
+                "Low estimated chance of gastric cancer based on your answers. "
+                "While you have one risk factor present, it alone is not sufficient for elevated risk. "
+                "However, reducing this risk factor and regular health checkups are recommended."
             )
 
-        # 6g. Final safety: If 2+ risk factors, allow model prediction to stand
-        # But cap at moderate if only 2 factors and model says high (unless H. pylori + chronic gastritis)
-        if n_major == 2 and risk_level == "high" and not (has_h_pylori and has_chronic_gastritis):
-            risk_level = "moderate"
-            if prob_cancer > 0.65:
-                prob_cancer = 0.65
-            risk_text = (
-                "Moderate to high risk – you have multiple risk factors present. "
-                "You should consult a doctor or gastroenterologist for proper evaluation."
-            )
+    # 6f. Safety rule: if there is only 1 major risk factor (and it's not H. pylori or chronic gastritis),
+    # do NOT allow the final tier to be "high". At most moderate.
+    if n_major == 1 and risk_level == "high" and not (has_h_pylori or has_chronic_gastritis):
+        risk_level = "moderate"
+        if prob_cancer > 0.59:
+            prob_cancer = 0.59
+        risk_text = (
+            "Moderate (borderline) risk – only one major risk factor was present. "
+            "You may still wish to discuss this with a doctor, especially if symptoms persist."
+        )
+
+    # 6g. Final safety: If 2+ risk factors, allow model prediction to stand
+    # But cap at moderate if only 2 factors and model says high (unless H. pylori + chronic gastritis)
+    if n_major == 2 and risk_level == "high" and not (has_h_pylori and has_chronic_gastritis):
+        risk_level = "moderate"
+        if prob_cancer > 0.65:
+            prob_cancer = 0.65
+        risk_text = (
+            "Moderate to high risk – you have multiple risk factors present. "
+            "You should consult a doctor or gastroenterologist for proper evaluation."
+        )
+
+    if timer:
+        timer.mark("rules")
+
+    # 7. Identify Risk Drivers for Clinical Report
+    all_drivers = []
+    if has_h_pylori:
+        all_drivers.append({"name": "H. Pylori Infection", "impact": "High"})
+    if has_family_history:
+        all_drivers.append({"name": "Family History", "impact": "High"})
+    if has_chronic_gastritis:
+        all_drivers.append({"name": "Chronic Gastritis", "impact": "High"})
+    if has_smoking:
+        all_drivers.append({"name": "Smoking", "impact": "Medium"})
+    if has_high_salt:
+        all_drivers.append({"name": "High Salt Diet", "impact": "Medium"})
+    if int(row.get("alcohol_consumption", 0) or 0) == 1:
+        all_drivers.append({"name": "Alcohol Consumption", "impact": "Medium"})
+    if int(row.get("age", 0) or 0) > 60:
+        all_drivers.append({"name": "Age > 60", "impact": "Medium"})
+
+    # Select Top 3
+    top_drivers = all_drivers[:3]
+    if not top_drivers:
+        top_drivers = [{"name": "General Health Factors", "impact": "Low"}]
+
+    # 8. Generate Recommended Next Steps
+    recommendations = []
+    if risk_level == "high":
+        recommendations.append("Immediate consultation with a gastroenterologist.")
+        recommendations.append("Schedule an Endoscopy (EGD) for detailed visualization.")
+    elif risk_level == "moderate":
+        recommendations.append("Consult a doctor for a physical examination.")
+        recommendations.append("Consider non-invasive screening tests.")
+    else: # Low
+        recommendations.append("Continue regular health checkups.")
+        recommendations.append("Maintain a healthy lifestyle.")
+
+    # Specific recommendations based on drivers
+    if has_h_pylori:
+        recommendations.append("Discuss H. Pylori eradication therapy with your doctor.")
+    if has_high_salt:
+        recommendations.append("Reduce salt intake and avoid processed foods.")
+    if has_smoking:
+        recommendations.append("Join a smoking cessation program.")
+    if has_chronic_gastritis:
+        recommendations.append("Monitor for symptoms of dyspepsia or pain.")
+
+    # Limit recommendations to top 4 to avoid clutter
+    recommendations = recommendations[:4]
+
+
+    if timer:
+        timer.mark("drivers")
+
+    return {
+        "probability_of_cancer": prob_cancer,
+        "risk_level": risk_level,
+        "message": risk_text,
+        "risk_drivers": top_drivers,
+        "recommendations": recommendations,
+    }
+
+
+def score_frame(input_df, timer=None):
+    """Scores every row of an imputed input frame with a single model call."""
+    final_input = encode_features(input_df)
+    if timer:
+        timer.mark("encode")
+    probs = model.predict_proba(final_input)[:, 1]
+    if timer:
+        timer.mark("predict_proba")
+    return [
+        assess_risk(float(prob), row, timer)
+        for prob, row in zip(probs, input_df.to_dict("records"))
+    ]
 
-        # 7. Identify Risk Drivers for Clinical Report
-        all_drivers = []
-        if has_h_pylori:
-            all_drivers.append({"name": "H. Pylori Infection", "impact": "High"})
-        if has_family_history:
-            all_drivers.append({"name": "Family History", "impact": "High"})
-        if has_chronic_gastritis:
-            all_drivers.append({"name": "Chronic Gastritis", "impact": "High"})
-        if has_smoking:
-            all_drivers.append({"name": "Smoking", "impact": "Medium"})
-        if has_high_salt:
-            all_drivers.append({"name": "High Salt Diet", "impact": "Medium"})
-        if int(input_df.get("alcohol_consumption", 0).iloc[0] or 0) == 1:
-            all_drivers.append({"name": "Alcohol Consumption", "impact": "Medium"})
-        if int(input_df.get("age", 0).iloc[0] or 0) > 60:
-            all_drivers.append({"name": "Age > 60", "impact": "Medium"})
-
-        # Select Top 3
-        top_drivers = all_drivers[:3]
-        if not top_drivers:
-            top_drivers = [{"name": "General Health Factors", "impact": "Low"}]
-
-        # 8. Generate Recommended Next Steps
-        recommendations = []
-        if risk_level == "high":
-            recommendations.append("Immediate consultation with a gastroenterologist.")
-            recommendations.append("Schedule an Endoscopy (EGD) for detailed visualization.")
-        elif risk_level == "moderate":
-            recommendations.append("Consult a doctor for a physical examination.")
-            recommendations.append("Consider non-invasive screening tests.")
-        else: # Low
-            recommendations.append("Continue regular health checkups.")
-            recommendations.append("Maintain a healthy lifestyle.")
-
-        # Specific recommendations based on drivers
-        if has_h_pylori:
-            recommendations.append("Discuss H. Pylori eradication therapy with your doctor.")
-        if has_high_salt:
-            recommendations.append("Reduce salt intake and avoid processed foods.")
-        if has_smoking:
-            recommendations.append("Join a smoking cessation program.")
-        if has_chronic_gastritis:
-            recommendations.append("Monitor for symptoms of dyspepsia or pain.")
-        
-        # Limit recommendations to top 4 to avoid clutter
-        recommendations = recommendations[:4]
-
-        result = {
-            "probability_of_cancer": prob_cancer,
-            "risk_level": risk_level,
-            "message": risk_text,
-            "risk_drivers": top_drivers,
-            "recommendations": recommendations,
-            "date": datetime.datetime.now().strftime("%Y-%m-%d")
-        }
+
+@app.route('/predict', methods=['POST'])
+@profiled
+def predict():
+    """Handles the prediction request."""
+    timer = StageTimer('/predict')
+    try:
+        data = request.get_json(force=True) or {}
+        timer.mark("parse")
+
+        # 1. Build a single-row DataFrame with expected columns
+        all_cols = NUMERIC_COLS + CATEGORICAL_COLS
+        row = {}
+        for col in all_cols:
+            value = data.get(col, None)
+            row[col] = value
+
+        input_df = build_input_frame(pd.DataFrame([row]))
+        timer.mark("dataframe")
+
+        # 2. Encode, predict and apply the clinical rules
+        result = score_frame(input_df, timer)[0]
+        result["date"] = datetime.datetime.now().strftime("%Y-%m-%d")
+
+        # 3. Queue the audit record; the write happens on the audit thread
+        get_audit_log().record(
+            user=token_user(),
+            model_version=MODEL_VERSION,
+            input_data=row,
+            probability=result["probability_of_cancer"],
+            risk_level=result["risk_level"],
+            drivers=result["risk_drivers"],
+        )
+        timer.mark("audit")
 
         return jsonify(result)
 
+    except TimeoutError as e:
+        # Predictions are not returned unless they can be audited
+        return jsonify({'error': str(e), 'message': 'Prediction could not be recorded.'}), 503
     except Exception as e:
         # Generic error handling
         return jsonify({'error': str(e), 'message': 'Prediction failed.'}), 500
 
+@app.route('/api/audit/predictions', methods=['GET'])
+def audit_predictions():
+    """Lists the signed-in user's audited predictions, newest first.
+
+    Optional query parameters: ``from`` and ``to`` (ISO dates) and ``limit``
+    (1 to 1000, default 100).
+    """
+    user = token_user()
+    if user is None:
+        return jsonify({'message': 'Authentication required'}), 401
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        records = get_audit_log().query(
+            user=user,
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'message': 'Invalid query parameters.'}), 400
+
+    return jsonify({'predictions': records})
+
+# --- Population Analytics ---
+
+# Rows scored per model call while streaming a cohort upload
+ANALYTICS_BATCH_SIZE = 1000
+# Distinct groups kept per dimension; the rest are folded into "Other"
+ANALYTICS_MAX_GROUPS = 50
+ANALYTICS_TOP_DRIVERS = 5
+
+COHORT_DIMENSIONS = ["geographical_location", "ethnicity", "age_band"]
+# Columns an upload must carry; other inputs are imputed as in /predict
+COHORT_REQUIRED_COLS = ["geographical_location", "ethnicity", "age"]
+RISK_LEVELS = ["low", "moderate", "high"]
+
+
+def age_band(age):
+    """Maps an age to the bands used by the synthetic risk model."""
+    if age < 40:
+        return "<40"
+    if age < 55:
+        return "40-54"
+    if age < 70:
+        return "55-69"
+    return "70+"
+
+
+class CohortAggregator:
+    """Running group-by aggregates over scored cohort rows.
+
+    Only counters are kept, so memory depends on the number of distinct
+    groups (capped at ``max_groups`` per dimension), not on cohort size.
+    """
+
+    def __init__(self, max_groups=ANALYTICS_MAX_GROUPS):
+        self.max_groups = max_groups
+        self.total = 0
+        self.probability_sum = 0.0
+        self.risk_levels = Counter()
+        self.drivers = Counter()
+        self.groups = {dim: {} for dim in COHORT_DIMENSIONS}
+
+    def _group(self, dim, key):
+        groups = self.groups[dim]
+        if key not in groups and len(groups) >= self.max_groups:
+            key = "Other"
+        if key not in groups:
+            groups[key] = {"count": 0, "probability_sum": 0.0, "risk_levels": Counter()}
+        return groups[key]
+
+    def add(self, row, assessment):
+        prob = assessment["probability_of_cancer"]
+        level = assessment["risk_level"]
+
+        self.total += 1
+        self.probability_sum += prob
+        self.risk_levels[level] += 1
+        for driver in assessment["risk_drivers"]:
+            self.drivers[driver["name"]] += 1
+
+        keys = {
+            "geographical_location": str(row["geographical_location"]),
+            "ethnicity": str(row["ethnicity"]),
+            "age_band": age_band(row["age"]),
+        }
+        for dim, key in keys.items():
+            group = self._group(dim, key)
+            group["count"] += 1
+            group["probability_sum"] += prob
+            group["risk_levels"][level] += 1
+
+    def summary(self, top_drivers=ANALYTICS_TOP_DRIVERS):
+        def levels(counter):
+            return {level: counter[level] for level in RISK_LEVELS}
+
+        def mean(total, count):
+            return total / count if count else 0.0
+
+        groups = {}
+        for dim, dim_groups in self.groups.items():
+            groups[dim] = [
+                {
+                    "group": key,
+                    "count": group["count"],
+                    "mean_probability": mean(group["probability_sum"], group["count"]),
+                    "risk_levels": levels(group["risk_levels"]),
+                }
+                for key, group in sorted(dim_groups.items(), key=lambda item: -item[1]["count"])
+            ]
+
+        return {
+            "total": self.total,
+            "mean_probability": mean(self.probability_sum, self.total),
+            "risk_levels": levels(self.risk_levels),
+            "top_drivers": [
+                {"name": name, "count": count}
+                for name, count in self.drivers.most_common(top_drivers)
+            ],
+            "groups": groups,
+        }
+
+
+def iter_cohort_chunks(stream, content_type):
+    """Yields DataFrame chunks from a streamed CSV or JSON Lines cohort upload."""
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return pd.read_json(stream, lines=True, chunksize=ANALYTICS_BATCH_SIZE)
+    # Keep "None" (a valid existing_conditions value) as a string
+    return pd.read_csv(stream, chunksize=ANALYTICS_BATCH_SIZE, keep_default_na=False, na_values=[""])
+
+
+@app.route('/api/analytics/cohort', methods=['POST'])
+def cohort_analytics():
+    """Scores an uploaded cohort in batches and returns aggregate risk statistics.
+
+    Accepts a CSV (or JSON Lines) body with the /predict fields per row, either
+    as the raw request body or as a multipart ``file`` field.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, content_type = upload.stream, upload.mimetype or ''
+        if upload.filename and upload.filename.endswith(('.jsonl', '.ndjson')):
+            content_type = 'application/x-ndjson'
+    else:
+        stream, content_type = request.stream, request.mimetype or ''
+
+    # Chunks are parsed lazily, so only reading the next chunk can fail on bad input
+    aggregator = CohortAggregator()
+    chunk = None
+    try:
+        chunks = iter(iter_cohort_chunks(stream, content_type))
+        chunk = next(chunks, None)
+        if chunk is not None:
+            missing = [col for col in COHORT_REQUIRED_COLS if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+    except (ValueError, pd.errors.ParserError) as e:
+        return jsonify({'error': str(e), 'message': 'Invalid cohort upload.'}), 400
+
+    while chunk is not None:
+        if not chunk.empty:
+            try:
+                input_df = build_input_frame(chunk)
+                for row, assessment in zip(input_df.to_dict("records"), score_frame(input_df)):
+                    aggregator.add(row, assessment)
+            except Exception as e:
+                return jsonify({'error': str(e), 'message': 'Cohort analysis failed.'}), 500
+        try:
+            chunk = next(chunks, None)
+        except (ValueError, pd.errors.ParserError) as e:
+            return jsonify({'error': str(e), 'message': 'Invalid cohort upload.'}), 400
+
+    if aggregator.total == 0:
+        return jsonify({'message': 'No data provided'}), 400
+
+    return jsonify(aggregator.summary())
+
 if __name__ == '__main__':
+    # Exit normally on SIGTERM so atexit handlers flush the audit log
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
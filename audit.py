@@ -0,0 +1,211 @@
+# audit.py
+#
+# Write-behind audit log of predictions. record() only appends to an
+# in-memory buffer; a background thread writes buffered records to SQLite in
+# one transaction per batch, when AUDIT_BATCH_SIZE records are pending or
+# every AUDIT_FLUSH_INTERVAL seconds, and drains the buffer on shutdown.
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+# Overridden by the AUDIT_DB_PATH environment variable when the log is opened
+AUDIT_DB_PATH = "audit.db"
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0
+# record() blocks once this many records are waiting, rather than dropping them,
+# and raises TimeoutError if the writer has not caught up within the timeout
+AUDIT_MAX_PENDING = 50000
+AUDIT_ENQUEUE_TIMEOUT = 5.0
+
+
+class AuditLog:
+    """Buffers prediction records and writes them in batches from a background thread."""
+
+    def __init__(self, path=None, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, max_pending=AUDIT_MAX_PENDING,
+                 enqueue_timeout=AUDIT_ENQUEUE_TIMEOUT):
+        if path is None:
+            path = os.environ.get("AUDIT_DB_PATH", AUDIT_DB_PATH)
+        self.path = os.path.abspath(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self._pending = []
+        self._written = 0
+        self._enqueued = 0
+        self._closed = False
+        self._flush_waiters = 0
+        self._cond = threading.Condition()
+        self._init_db()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _init_db(self):
+        conn = self._connect()
+        c = conn.cursor()
+        # WAL lets queries read while the writer thread commits
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute('''CREATE TABLE IF NOT EXISTS predictions
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      created_at TEXT NOT NULL,
+                      user TEXT,
+                      model_version TEXT,
+                      probability REAL,
+                      risk_level TEXT,
+                      input TEXT,
+                      drivers TEXT)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_predictions_user_created ON predictions (user, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_predictions_created ON predictions (created_at)")
+        conn.commit()
+        conn.close()
+
+    def record(self, user, model_version, input_data, probability, risk_level, drivers):
+        """Queues one prediction for writing; returns without touching the database.
+
+        Raises TimeoutError if the buffer stays full for ``enqueue_timeout``
+        seconds, e.g. because the database is locked or the disk is full.
+        """
+        row = (
+            datetime.datetime.utcnow().isoformat(timespec="microseconds"),
+            user,
+            model_version,
+            probability,
+            risk_level,
+            json.dumps(input_data, default=str),
+            json.dumps(drivers),
+        )
+        with self._cond:
+            has_room = self._cond.wait_for(
+                lambda: self._closed or len(self._pending) < self.max_pending,
+                timeout=self.enqueue_timeout,
+            )
+            if self._closed:
+                raise RuntimeError("Audit log is closed.")
+            if not has_room:
+                print(f"Audit Log Error: {len(self._pending)} records waiting, prediction not recorded.")
+                raise TimeoutError("Audit log is not keeping up with predictions.")
+            self._pending.append(row)
+            self._enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: (len(self._pending) >= self.batch_size or self._closed
+                                 or (self._flush_waiters and self._pending)),
+                        timeout=self.flush_interval,
+                    )
+                    batch, self._pending = self._pending, []
+                    closing = self._closed
+                    # Wake record() callers held back by max_pending
+                    self._cond.notify_all()
+
+                if batch and not self._write(conn, batch):
+                    if closing:
+                        print(f"Audit Log Error: {len(batch)} records could not be written on shutdown.")
+                        return
+                    with self._cond:
+                        # Keep the records for the next attempt instead of losing them
+                        self._pending[:0] = batch
+                        self._cond.wait(self.flush_interval)
+                    continue
+
+                with self._cond:
+                    self._written += len(batch)
+                    self._cond.notify_all()
+                    if closing and not self._pending:
+                        return
+        finally:
+            conn.close()
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO predictions (created_at, user, model_version, probability, "
+                    "risk_level, input, drivers) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+            return True
+        except sqlite3.Error as e:
+            print(f"Audit Log Error: {e}")
+            return False
+
+    def flush(self, timeout=None):
+        """Blocks until every record queued so far has been written."""
+        with self._cond:
+            target = self._enqueued
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: self._written >= target, timeout=timeout)
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self):
+        """Writes everything still buffered and stops the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def query(self, user=None, start=None, end=None, limit=100):
+        """Returns recorded predictions, newest first.
+
+        ``start`` and ``end`` are ISO dates or timestamps (``end`` is
+        inclusive of the whole day when given as a date).
+        """
+        sql = "SELECT id, created_at, user, model_version, probability, risk_level, input, drivers FROM predictions"
+        clauses, params = [], []
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        if start:
+            clauses.append("created_at >= ?")
+            params.append(start)
+        if end:
+            clauses.append("created_at < ?")
+            params.append(_end_bound(end))
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        return [
+            {
+                "id": row[0],
+                "created_at": row[1],
+                "user": row[2],
+                "model_version": row[3],
+                "probability_of_cancer": row[4],
+                "risk_level": row[5],
+                "input": json.loads(row[6]),
+                "risk_drivers": json.loads(row[7]),
+            }
+            for row in rows
+        ]
+
+
+def _end_bound(end):
+    # A bare date covers that whole day
+    if len(end) == 10:
+        day = datetime.date.fromisoformat(end) + datetime.timedelta(days=1)
+        return day.isoformat()
+    return end
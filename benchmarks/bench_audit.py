@@ -0,0 +1,124 @@
+# benchmarks/bench_audit.py
+#
+# /predict latency with the audit log disabled, with the write-behind audit
+# log, and with a synchronous connect + INSERT + commit per request (the
+# pattern the auth routes use for users.db), plus the raw cost of record().
+#
+#   python -m benchmarks.bench_audit [--requests 300] [--clients 4] [--rounds 5]
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import ROOT, print_results, sample_patients, summarize
+
+
+class NoAuditLog:
+    def record(self, **fields):
+        pass
+
+
+class SyncAuditLog:
+    """Writes each record in its own connection and transaction."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, user, model_version, input_data, probability, risk_level, drivers):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute(
+            "INSERT INTO predictions (created_at, user, model_version, probability, "
+            "risk_level, input, drivers) VALUES (datetime('now'), ?, ?, ?, ?, ?, ?)",
+            (user, model_version, probability, risk_level, json.dumps(input_data), json.dumps(drivers)),
+        )
+        conn.commit()
+        conn.close()
+
+
+def time_predict(client_factory, patients, requests, clients):
+    """Returns ``(latencies, elapsed)`` for ``requests`` /predict calls from ``clients`` threads."""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = client_factory()
+        local = []
+        for i in range(offset, requests, clients):
+            t0 = time.perf_counter()
+            resp = client.post("/predict", json=patients[i % len(patients)])
+            local.append(time.perf_counter() - t0)
+            assert resp.status_code == 200, resp.get_json()
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Impact of the prediction audit log on /predict latency.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import app
+    from audit import AuditLog
+
+    workdir = tempfile.mkdtemp(prefix="gastric-audit-bench-")
+    patients = sample_patients(200)
+    modes = {
+        "predict.no_audit": NoAuditLog(),
+        "predict.write_behind": AuditLog(os.path.join(workdir, "write_behind.db")),
+    }
+    # Reuse the audit schema for the synchronous baseline
+    sync_path = os.path.join(workdir, "sync.db")
+    AuditLog(sync_path).close()
+    modes["predict.sync_insert"] = SyncAuditLog(sync_path)
+
+    # Warm up the model and the Flask app before timing anything
+    app.audit_log = modes["predict.no_audit"]
+    time_predict(app.app.test_client, patients, 20, 1)
+
+    # Interleave the modes in rounds so drift in machine load hits them equally
+    samples = {name: ([], 0.0) for name in modes}
+    per_round = max(args.requests // args.rounds, 1)
+    for _ in range(args.rounds):
+        for name, log in modes.items():
+            app.audit_log = log
+            latencies, elapsed = time_predict(app.app.test_client, patients, per_round, args.clients)
+            samples[name] = (samples[name][0] + latencies, samples[name][1] + elapsed)
+    results = {name: summarize(latencies, elapsed) for name, (latencies, elapsed) in samples.items()}
+
+    write_behind = modes["predict.write_behind"]
+    latencies = []
+    for i in range(10000):
+        t0 = time.perf_counter()
+        write_behind.record("bench@example.com", app.MODEL_VERSION, patients[i % len(patients)], 0.5, "moderate", [])
+        latencies.append(time.perf_counter() - t0)
+    results["audit.record_call"] = summarize(latencies, sum(latencies))
+    write_behind.close()
+    app.audit_log = None
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    base = results["predict.no_audit"]["p50_ms"]
+    for name in ("predict.write_behind", "predict.sync_insert"):
+        print(f"{name}: p50 {results[name]['p50_ms'] - base:+.3f} ms vs no audit")
+
+
+if __name__ == "__main__":
+    main()
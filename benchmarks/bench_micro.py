@@ -0,0 +1,53 @@
+# benchmarks/bench_micro.py
+#
+# Micro-benchmarks of the stages behind the API, each timed in isolation on
+# inputs sampled from synthetic_gastric_risk_dataset.csv. Needs the trained
+# model (run train_and_save.py first).
+
+import time
+
+from benchmarks.common import CHAT_QUESTIONS, sample_patients, summarize
+
+
+def _time_calls(fn, inputs, seconds):
+    """Calls ``fn`` on ``inputs`` round-robin for ``seconds`` and summarizes latencies."""
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        arg = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - t0)
+        i += 1
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_micro(seconds=1.0, samples=200, seed=42):
+    """Returns ``{"micro.<stage>": summary}`` for every benchmarked stage."""
+    import pandas as pd
+
+    import app
+    from reports import render_report
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    patients = sample_patients(samples, seed)
+    frames = [app.build_input_frame(pd.DataFrame([p])) for p in patients]
+    encoded = [app.encode_features(df) for df in frames]
+    rows = [df.to_dict("records")[0] for df in frames]
+    probs = [float(app.model.predict_proba(x)[:, 1][0]) for x in encoded]
+    assessments = [app.assess_risk(prob, row) for prob, row in zip(probs, rows)]
+    reports = [dict(a, date="2026-01-01", patient_name="Benchmark Patient") for a in assessments]
+
+    def tfidf_query(question):
+        query_vec = app.VECTORIZER.transform([question])
+        cosine_similarity(query_vec, app.TFIDF_MATRIX).flatten().argmax()
+
+    return {
+        "micro.encode": _time_calls(app.encode_features, frames, seconds),
+        "micro.predict_proba": _time_calls(app.model.predict_proba, encoded, seconds),
+        "micro.rules": _time_calls(lambda i: app.assess_risk(probs[i], rows[i]), list(range(len(rows))), seconds),
+        "micro.tfidf_query": _time_calls(tfidf_query, CHAT_QUESTIONS, seconds),
+        "micro.pdf_render": _time_calls(render_report, reports, seconds),
+    }
@@ -0,0 +1,286 @@
+# benchmarks/bench_report_render.py
+#
+# Reports/sec and bytes copied for PDF report rendering, before and after
+# the prebuilt report template, plus a parity check of the two outputs.
+#
+#   python -m benchmarks.bench_report_render [--seconds 2]
+
+import argparse
+import datetime
+import re
+import time
+import zlib
+
+from fpdf import FPDF
+
+import reports
+
+SAMPLE_REPORTS = [
+    {
+        "risk_level": "high",
+        "probability_of_cancer": 0.85,
+        "risk_drivers": [
+            {"name": "H. Pylori Infection", "impact": "High"},
+            {"name": "Family History", "impact": "High"},
+            {"name": "Chronic Gastritis", "impact": "High"},
+        ],
+        "recommendations": [
+            "Immediate consultation with a gastroenterologist.",
+            "Schedule an Endoscopy (EGD) for detailed visualization.",
+            "Discuss H. Pylori eradication therapy with your doctor.",
+            "Reduce salt intake and avoid processed foods.",
+        ],
+        "date": "2026-01-01",
+        "patient_name": "Jane Doe",
+    },
+    {
+        "risk_level": "moderate",
+        "probability_of_cancer": 0.35,
+        "risk_drivers": [{"name": "Smoking", "impact": "Medium"}],
+        "recommendations": [
+            "Consult a doctor for a physical examination.",
+            "Consider non-invasive screening tests.",
+        ],
+        "date": "2026-01-02",
+        "patient_name": "Zoë Ångström",
+    },
+    {
+        "risk_level": "low",
+        "probability_of_cancer": 0.1,
+        "risk_drivers": [],
+        "recommendations": [],
+        "date": "2026-01-03",
+    },
+    {
+        # Long enough to push the disclaimer onto a second page
+        "risk_level": "high",
+        "probability_of_cancer": 0.7,
+        "risk_drivers": [{"name": f"Driver {i}", "impact": "High"} for i in range(12)],
+        "recommendations": [f"Recommendation number {i} for follow-up care." for i in range(12)],
+        "date": "2026-01-04",
+        "patient_name": "Long Report",
+    },
+]
+
+
+def legacy_render_report(data, pdf_class=FPDF):
+    """download_report() as it was before the report template (the baseline)."""
+    # Extract data
+    risk_level = data.get('risk_level', 'Unknown').upper()
+    probability = data.get('probability_of_cancer', 0)
+    drivers = data.get('risk_drivers', [])
+    recommendations = data.get('recommendations', [])
+    date_str = data.get('date', datetime.datetime.now().strftime("%Y-%m-%d"))
+    prob_percent = f"{float(probability) * 100:.2f}%"
+    patient_name = data.get('patient_name', 'Guest').encode('latin-1', 'replace').decode('latin-1')
+
+    # Create PDF
+    pdf = pdf_class()
+    pdf.add_page()
+    
+    # Title
+    pdf.set_font("Arial", 'B', 24)
+    pdf.cell(0, 15, "Clinical Assessment Report", ln=True, align='C')
+    pdf.set_font("Arial", '', 12)
+    pdf.cell(0, 8, "Gastric Cancer Risk Estimation System", ln=True, align='C')
+    pdf.cell(0, 8, f"Date: {date_str}", ln=True, align='C')
+    pdf.cell(0, 8, f"Patient Name: {patient_name}", ln=True, align='C')
+    pdf.ln(10)
+
+    # Risk Profile
+    pdf.set_fill_color(245, 245, 245)
+    pdf.rect(10, pdf.get_y(), 190, 40, 'F')
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, "Risk Profile", ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", '', 12)
+    current_y = pdf.get_y()
+    
+    # Analysis Result
+    pdf.set_xy(30, current_y)
+    pdf.cell(60, 6, "Analysis Result", ln=True, align='C')
+    pdf.set_font("Arial", 'B', 20)
+    
+    # Color logic isn't supported directly in cell text easily without multi-cell, 
+    # but we can set text color.
+    if risk_level == 'HIGH':
+        pdf.set_text_color(211, 47, 47) # Red
+    elif risk_level == 'MODERATE':
+        pdf.set_text_color(239, 108, 0) # Orange
+    else:
+        pdf.set_text_color(46, 125, 50) # Green
+        
+    pdf.set_xy(30, current_y + 8)
+    pdf.cell(60, 10, f"{risk_level} RISK", ln=True, align='C')
+    pdf.set_text_color(0, 0, 0) # Reset
+
+    # Probability
+    pdf.set_xy(120, current_y)
+    pdf.set_font("Arial", '', 12)
+    pdf.cell(60, 6, "Estimated Probability", ln=True, align='C')
+    pdf.set_font("Arial", 'B', 20)
+    pdf.set_xy(120, current_y + 8)
+    pdf.cell(60, 10, prob_percent, ln=True, align='C')
+    
+    pdf.ln(20)
+
+    # Top Risk Drivers
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, "Top Risk Drivers", ln=True)
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(5)
+
+    pdf.set_font("Arial", '', 12)
+    if drivers:
+        for driver in drivers:
+            name = driver.get('name', '').encode('latin-1', 'replace').decode('latin-1')
+            impact = driver.get('impact', '').encode('latin-1', 'replace').decode('latin-1')
+            pdf.set_font("Arial", 'B', 12)
+            pdf.write(5, f"- {name}")
+            pdf.set_font("Arial", '', 11)
+            pdf.write(5, f" ({impact} Impact)")
+            pdf.ln(8)
+    else:
+        pdf.cell(0, 10, "No specific major risk drivers identified.", ln=True)
+    
+    pdf.ln(10)
+
+    # Recommendations
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, "Recommended Next Steps", ln=True)
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(5)
+
+    pdf.set_font("Arial", '', 12)
+    if recommendations:
+        for step in recommendations:
+            step_clean = step.encode('latin-1', 'replace').decode('latin-1')
+            pdf.write(5, f"- {step_clean}")
+            pdf.ln(8)
+    else:
+        pdf.cell(0, 10, "Consult a healthcare provider.", ln=True)
+
+    # Disclaimer
+    pdf.ln(20)
+    pdf.set_font("Arial", 'I', 10)
+    pdf.set_text_color(100, 100, 100)
+    pdf.multi_cell(0, 5, "DISCLAIMER: This report is generated by an AI Support Tool. It is NOT a definitive medical diagnosis. Please consult a qualified doctor for interpretation and clinical decisions.", align='C')
+
+    # Output - FPDF classic way
+    # dest='S' returns the document as a string.
+    response_string = pdf.output(dest='S')
+
+    # Encode to bytes for the response
+    return f"Gastric_Risk_Report_{date_str}.pdf", response_string.encode('latin-1')
+
+
+class _CountingPages(dict):
+    """Page table that counts the bytes copied by ``pages[n] += s``."""
+
+    copied = 0
+
+    def __setitem__(self, key, value):
+        _CountingPages.copied += len(value)
+        super().__setitem__(key, value)
+
+
+def _counting(pdf_class, buffer_is_str):
+    class CountingPDF(pdf_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pages = _CountingPages()
+
+        def _out(self, s):
+            if self.state != 2:
+                size = len(s) + 1 if isinstance(s, (str, bytes)) else len(str(s)) + 1
+                # A str buffer is rebuilt on every append; a bytearray grows in place
+                _CountingPages.copied += size + (len(self.buffer) if buffer_is_str else 0)
+            super()._out(s)
+
+        def output(self, name='', dest=''):
+            result = super().output(name, dest)
+            if dest == 'S':
+                # The caller's latin-1 encode copies the document once more
+                _CountingPages.copied += len(result)
+            return result
+
+        def output_bytes(self):
+            result = super().output_bytes()
+            # The final bytes() copy of the buffer
+            _CountingPages.copied += len(result)
+            return result
+
+    return CountingPDF
+
+
+def bytes_copied(render):
+    _CountingPages.copied = 0
+    for data in SAMPLE_REPORTS:
+        render(data)
+    return _CountingPages.copied / len(SAMPLE_REPORTS)
+
+
+def reports_per_second(render, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for data in SAMPLE_REPORTS:
+            render(data)
+        count += len(SAMPLE_REPORTS)
+    return count / seconds
+
+
+def _objects(pdf_bytes):
+    """Splits a PDF into its objects, inflating compressed streams."""
+    pdf_bytes = re.sub(rb"/CreationDate \(D:\d+\)", b"", bytes(pdf_bytes))
+    objects = []
+    for obj in re.findall(rb"\d+ 0 obj\n(.*?)endobj", pdf_bytes, re.S):
+        stream = re.search(rb"stream\n(.*)\nendstream", obj, re.S)
+        if stream and b"/FlateDecode" in obj:
+            obj = obj[:stream.start()] + zlib.decompress(stream.group(1))
+        objects.append(obj)
+    return objects
+
+
+def check_parity():
+    """Asserts both renderers draw the same pages with the same resources."""
+    for data in SAMPLE_REPORTS:
+        old_name, old_pdf = legacy_render_report(data)
+        new_name, new_pdf = reports.render_report(data)
+        assert old_name == new_name, (old_name, new_name)
+        assert _objects(old_pdf) == _objects(new_pdf), f"output differs for {data.get('patient_name')}"
+    # Run again so the second pass replays cached fragments
+    for data in SAMPLE_REPORTS:
+        assert _objects(legacy_render_report(data)[1]) == _objects(reports.render_report(data)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent per renderer")
+    args = parser.parse_args()
+
+    check_parity()
+    print(f"Parity: {len(SAMPLE_REPORTS)} sample reports render identical pages")
+
+    legacy_counting = _counting(FPDF, buffer_is_str=True)
+    template_counting = _counting(reports.ReportPDF, buffer_is_str=False)
+    original = reports.ReportPDF
+    reports.ReportPDF = template_counting
+    try:
+        copied_after = bytes_copied(reports.render_report)
+    finally:
+        reports.ReportPDF = original
+    copied_before = bytes_copied(lambda data: legacy_render_report(data, legacy_counting))
+
+    before = reports_per_second(legacy_render_report, args.seconds)
+    after = reports_per_second(reports.render_report, args.seconds)
+
+    print(f"{'':<10}{'reports/sec':>14}{'bytes copied/report':>22}")
+    print(f"{'before':<10}{before:>14.1f}{copied_before:>22,.0f}")
+    print(f"{'after':<10}{after:>14.1f}{copied_after:>22,.0f}")
+    print(f"speedup: {after / before:.2f}x, copies: {copied_after / copied_before:.0%} of before")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/common.py
+#
+# Latency summaries, sample inputs and baseline comparison shared by the
+# micro-benchmarks and the load test.
+
+import json
+import math
+import os
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(ROOT, "synthetic_gastric_risk_dataset.csv")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+CHAT_QUESTIONS = [
+    "What are the symptoms of gastric cancer?",
+    "How is H. pylori infection treated?",
+    "Does a high salt diet increase risk?",
+    "What is an endoscopy?",
+    "Is stomach cancer hereditary?",
+    "How does smoking affect the stomach?",
+]
+
+
+def sample_patients(n, seed=42):
+    """Samples ``n`` /predict payloads from the synthetic dataset."""
+    # Keep "None" (a valid existing_conditions value) as a string
+    df = pd.read_csv(DATASET_PATH, keep_default_na=False, na_values=[""])
+    df = df.drop(columns=["label"]).sample(n=n, replace=n > len(df), random_state=seed)
+    return df.to_dict("records")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Summarizes per-call latencies (seconds) collected over ``elapsed`` seconds."""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+    }
+
+
+def print_results(results):
+    print(f"{'benchmark':<32}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for name, r in results.items():
+        print(
+            f"{name:<32}{r['count']:>8}{r['errors']:>8}{r['p50_ms']:>10.3f}"
+            f"{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['throughput']:>10.1f}"
+        )
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def find_regressions(results, baseline, tolerance):
+    """Lists benchmarks whose p95 latency or throughput is worse than the
+    baseline by more than ``tolerance`` (a fraction, e.g. 0.25)."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: {r['errors']} errors (baseline {base.get('errors', 0)})")
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {r['p95_ms']:.2f} ms vs baseline {base['p95_ms']:.2f} ms")
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: {r['throughput']:.1f} ops/s vs baseline {base['throughput']:.1f} ops/s")
+    return regressions
@@ -0,0 +1,142 @@
+# benchmarks/loadtest.py
+#
+# Local multi-client load generator for the HTTP API. Each endpoint is
+# driven in turn by ``clients`` concurrent threads for ``seconds`` seconds,
+# against either a running server (--url) or the app served in-process.
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import CHAT_QUESTIONS, sample_patients, summarize
+
+BENCH_USER = {"name": "Load", "surname": "Test", "email": "loadtest@example.com", "password": "loadtest-password"}
+
+
+def _post(base_url, path, payload, timeout=30):
+    req = urllib.request.Request(
+        base_url + path,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def start_local_server():
+    """Serves the app on an ephemeral port in a background thread.
+
+    The server runs from a temporary working directory, with its own audit
+    log, so the login user and the predictions it records do not end up in
+    the repository's users.db and audit.db. Returns
+    ``(server, base_url, workdir)``; the caller removes ``workdir``.
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import app
+    from audit import AuditLog
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    workdir = tempfile.mkdtemp(prefix="gastric-loadtest-")
+    os.chdir(workdir)
+    app.init_db()
+    app.migrate_db()
+    app.audit_log = AuditLog(os.path.join(workdir, "audit.db"))
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", workdir
+
+
+def build_scenarios(base_url, samples=200, seed=42):
+    """Returns ``{path: [payload, ...]}`` for every endpoint under test."""
+    patients = sample_patients(samples, seed)
+
+    # Report payloads are real /predict results for a slice of the sample
+    reports = []
+    for patient in patients[:20]:
+        status, body = _post(base_url, "/predict", patient)
+        if status == 200:
+            reports.append(dict(json.loads(body), patient_name="Load Test"))
+
+    status, _ = _post(base_url, "/api/auth/signup", BENCH_USER)
+    if status not in (200, 409):
+        raise RuntimeError(f"Could not create the load test user (HTTP {status})")
+
+    return {
+        "/predict": patients,
+        "/api/chat": [{"message": q} for q in CHAT_QUESTIONS],
+        "/api/download_report": reports,
+        "/api/auth/login": [{"email": BENCH_USER["email"], "password": BENCH_USER["password"]}],
+    }
+
+
+def drive(base_url, path, payloads, clients, seconds):
+    """Runs ``clients`` threads posting ``payloads`` to ``path`` for ``seconds``."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(offset):
+        local, failed, i = [], 0, offset
+        while time.perf_counter() < deadline:
+            payload = payloads[i % len(payloads)]
+            t0 = time.perf_counter()
+            try:
+                status, _ = _post(base_url, path, payload)
+            except (OSError, http.client.HTTPException):
+                status = None
+            elapsed = time.perf_counter() - t0
+            if status is not None and 200 <= status < 300:
+                local.append(elapsed)
+            else:
+                failed += 1
+            i += clients
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def run_load(base_url=None, clients=4, seconds=5.0, samples=200, seed=42):
+    """Returns ``{"load.<path>": summary}`` for every endpoint."""
+    server = None
+    cwd = os.getcwd()
+    if base_url is None:
+        server, base_url, workdir = start_local_server()
+    try:
+        scenarios = build_scenarios(base_url, samples, seed)
+        return {
+            f"load.{path}": drive(base_url, path, payloads, clients, seconds)
+            for path, payloads in scenarios.items()
+        }
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            import app
+            app.audit_log.close()
+            app.audit_log = None
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,77 @@
+# benchmarks/run.py
+#
+# Runs the micro-benchmarks and the load test, prints p50/p95/p99 latency
+# and throughput, and compares the results with a stored baseline.
+#
+#   python -m benchmarks.run --save-baseline   # record a baseline on this machine
+#   python -m benchmarks.run --check           # exit 1 if anything regressed
+#
+# Baselines are machine specific: record and check on the same hardware.
+
+import argparse
+import os
+import sys
+
+from benchmarks.common import (
+    BASELINE_PATH,
+    ROOT,
+    find_regressions,
+    load_baseline,
+    print_results,
+    save_baseline,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks and load test with regression baselines.")
+    parser.add_argument("--micro-only", action="store_true", help="skip the load test")
+    parser.add_argument("--load-only", action="store_true", help="skip the micro-benchmarks")
+    parser.add_argument("--url", help="load test a running server instead of an in-process one")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent load test clients")
+    parser.add_argument("--seconds", type=float, default=5.0, help="load test duration per endpoint")
+    parser.add_argument("--micro-seconds", type=float, default=1.0, help="duration per micro-benchmark")
+    parser.add_argument("--samples", type=int, default=200, help="dataset rows sampled as inputs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail when results regress past the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p95/throughput regression as a fraction of the baseline")
+    args = parser.parse_args(argv)
+
+    # app.py loads the model, feature list and handbook from the working directory
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    from benchmarks.bench_micro import run_micro
+    from benchmarks.loadtest import run_load
+
+    results = {}
+    if not args.load_only:
+        results.update(run_micro(args.micro_seconds, args.samples, args.seed))
+    if not args.micro_only:
+        results.update(run_load(args.url, args.clients, args.seconds, args.samples, args.seed))
+
+    print_results(results)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print(f"No baseline at {args.baseline}; run with --save-baseline first.")
+            return 1
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%} of baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} of baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,8 @@ export const AuthProvider = ({ children }) => {
   }
 
   const logout = () => {
+    // The server-set token cookie is httponly, so only the server can clear it
+    fetch('/api/auth/logout', { method: 'POST' }).catch(() => {})
     setToken(null)
     setUser(null)
     localStorage.removeItem('token')
@@ -0,0 +1,145 @@
+# metrics.py
+#
+# Lightweight in-process request metrics exposed in the Prometheus text
+# format. Observations are a bisect and a few additions under one lock, so
+# they are cheap enough to leave on for every request.
+
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram; callers hold the registry lock."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """Yields ``(le, cumulative_count)`` pairs, ending with ``+Inf``."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield repr(bound), total
+        yield "+Inf", self.count
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """Per-route request counts, errors, in-flight gauges and latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._errors = Counter()
+        self._in_flight = Counter()
+        self._durations = {}
+        self._stages = {}
+
+    def request_started(self, route):
+        with self._lock:
+            self._in_flight[route] += 1
+
+    def request_finished(self, route, method, status, seconds, error=False):
+        with self._lock:
+            self._in_flight[route] -= 1
+            self._requests[(route, method, status)] += 1
+            if error:
+                self._errors[route] += 1
+            histogram = self._durations.get(route)
+            if histogram is None:
+                histogram = self._durations[route] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_stage(self, route, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get((route, stage))
+            if histogram is None:
+                histogram = self._stages[(route, stage)] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram_lines(name, histograms):
+            for key, histogram in sorted(histograms.items()):
+                labels = _labels(**dict(key))
+                for le, count in histogram.samples():
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        with self._lock:
+            lines.append("# HELP gastric_requests_total Requests handled, by route, method and status.")
+            lines.append("# TYPE gastric_requests_total counter")
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f"gastric_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}")
+
+            lines.append("# HELP gastric_request_errors_total Requests that failed with a 5xx or an unhandled exception.")
+            lines.append("# TYPE gastric_request_errors_total counter")
+            for route, count in sorted(self._errors.items()):
+                lines.append(f"gastric_request_errors_total{{{_labels(route=route)}}} {count}")
+
+            lines.append("# HELP gastric_requests_in_flight Requests currently being handled.")
+            lines.append("# TYPE gastric_requests_in_flight gauge")
+            for route, count in sorted(self._in_flight.items()):
+                lines.append(f"gastric_requests_in_flight{{{_labels(route=route)}}} {count}")
+
+            lines.append("# HELP gastric_request_duration_seconds Request latency by route.")
+            lines.append("# TYPE gastric_request_duration_seconds histogram")
+            histogram_lines(
+                "gastric_request_duration_seconds",
+                {(("route", route),): h for route, h in self._durations.items()},
+            )
+
+            lines.append("# HELP gastric_stage_duration_seconds Latency of the stages inside a handler.")
+            lines.append("# TYPE gastric_stage_duration_seconds histogram")
+            histogram_lines(
+                "gastric_stage_duration_seconds",
+                {(("route", route), ("stage", stage)): h for (route, stage), h in self._stages.items()},
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class StageTimer:
+    """Times consecutive stages of one handler.
+
+    Each ``mark(stage)`` records the time since the previous mark (or since
+    the timer was created) under ``stage``.
+    """
+
+    def __init__(self, route, registry=REGISTRY):
+        self.route = route
+        self.registry = registry
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.registry.observe_stage(self.route, stage, now - self._last)
+        self._last = now
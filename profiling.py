@@ -0,0 +1,160 @@
+# profiling.py
+#
+# Opt-in per-request profiling. When PROFILING_ENABLED is set, handlers
+# wrapped with @profiled run under cProfile if the request carries an
+# "X-Profile: 1" header or is picked by PROFILING_SAMPLE_RATE. Each profile
+# is written with a JSON metadata sidecar to a directory that keeps only the
+# newest PROFILING_MAX_FILES profiles.
+#
+# Aggregate the hottest functions across the kept profiles with:
+#
+#   python profiling.py [--route /predict] [--sort cumulative] [--limit 30]
+
+import argparse
+import cProfile
+import datetime
+import functools
+import glob
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+from flask import request
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+# Fraction of requests profiled without the header (0 disables sampling)
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.environ.get("PROFILING_DIR", "profiles")
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", "200"))
+PROFILE_HEADER = "X-Profile"
+
+# cProfile cannot run two profilers at once, so concurrent requests that
+# would be profiled while another one is are simply served unprofiled.
+_profile_lock = threading.Lock()
+
+
+def _should_profile():
+    if not PROFILING_ENABLED:
+        return None
+    if request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return "header"
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def _status_code(rv):
+    if isinstance(rv, tuple) and len(rv) > 1 and isinstance(rv[1], int):
+        return rv[1]
+    return getattr(rv, "status_code", 200)
+
+
+def _rotate(directory, max_files):
+    profiles = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    for path in profiles[:max(len(profiles) - max_files, 0)]:
+        for stale in (path, path[:-len(".prof")] + ".json"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+def _save(profiler, metadata):
+    directory = PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    # Timestamp first so names sort oldest to newest for rotation
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    route = metadata["route"].strip("/").replace("/", "_") or "root"
+    base = os.path.join(directory, f"{stamp}_{route}_{metadata['profile_id']}")
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".json", "w") as f:
+        json.dump(metadata, f, indent=2)
+    _rotate(directory, PROFILING_MAX_FILES)
+
+
+def profiled(view):
+    """Runs ``view`` under cProfile when profiling is triggered for the request."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        trigger = _should_profile()
+        if trigger is None or not _profile_lock.acquire(blocking=False):
+            return view(*args, **kwargs)
+
+        profile_id = uuid.uuid4().hex[:12]
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            rv = profiler.runcall(view, *args, **kwargs)
+        finally:
+            _profile_lock.release()
+        duration = time.perf_counter() - start
+
+        try:
+            _save(profiler, {
+                "profile_id": profile_id,
+                "route": request.url_rule.rule if request.url_rule else request.path,
+                "method": request.method,
+                "trigger": trigger,
+                "status": _status_code(rv),
+                "duration_seconds": duration,
+                "content_length": request.content_length,
+                "remote_addr": request.remote_addr,
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            })
+        except OSError as e:
+            print(f"Profiling Error: could not save profile - {e}")
+        return rv
+
+    return wrapper
+
+
+def hot_functions(directory=None, route=None, sort="cumulative", limit=30):
+    """Returns a text report of the hottest functions across saved profiles.
+
+    ``route`` restricts the report to profiles of one route, e.g. "/predict".
+    """
+    directory = directory or PROFILING_DIR
+    paths = []
+    durations = []
+    for meta_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        prof_path = meta_path[:-len(".json")] + ".prof"
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not os.path.exists(prof_path) or (route and metadata.get("route") != route):
+            continue
+        paths.append(prof_path)
+        durations.append(metadata.get("duration_seconds", 0.0))
+
+    if not paths:
+        return "No profiles found."
+
+    out = io.StringIO()
+    durations.sort()
+    out.write(
+        f"{len(paths)} profiles, median {durations[len(durations) // 2] * 1000:.1f} ms, "
+        f"max {durations[-1] * 1000:.1f} ms\n"
+    )
+    stats = pstats.Stats(*paths, stream=out)
+    # Skip the per-file header pstats prints for every merged profile
+    stats.files = []
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate hot functions across saved request profiles.")
+    parser.add_argument("--dir", default=PROFILING_DIR, help="profile directory")
+    parser.add_argument("--route", help="only include profiles of this route, e.g. /predict")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key (cumulative, tottime, ncalls)")
+    parser.add_argument("--limit", type=int, default=30, help="number of functions to show")
+    args = parser.parse_args()
+    print(hot_functions(args.dir, args.route, args.sort, args.limit))
@@ -0,0 +1,438 @@
+# reports.py
+#
+# PDF clinical report rendering and the background job queue used to render
+# reports off the request thread. Kept separate from app.py so the worker
+# pool's fork server only preloads this module and FPDF. Workers still
+# import the script that started the server, so under `python app.py` each
+# one also loads the model and the chatbot index; under `flask run` or a
+# WSGI server they do not.
+
+import atexit
+import datetime
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fpdf import FPDF
+
+# Worker processes used to render queued reports (one per core by default)
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", os.cpu_count() or 1))
+# Workers are not forked from the threaded server process, which could copy
+# a lock held by another request thread into the child
+REPORT_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# Finished jobs are kept for download for this long
+REPORT_JOB_TTL_SECONDS = 3600
+# Upper bounds on queued work. Rendered PDFs stay in memory until their job
+# expires, so the total across all jobs is capped as well as each batch.
+REPORT_MAX_JOBS = 500
+REPORT_MAX_BATCH = 1000
+REPORT_MAX_RETAINED = 5000
+
+
+DISCLAIMER = (
+    "DISCLAIMER: This report is generated by an AI Support Tool. It is NOT a definitive "
+    "medical diagnosis. Please consult a qualified doctor for interpretation and clinical decisions."
+)
+
+# Page state a layout fragment can read or change
+_STATE_ATTRS = (
+    "x", "y", "lasth", "font_family", "font_style", "font_size_pt", "underline",
+    "draw_color", "fill_color", "text_color", "color_flag", "ws", "line_width",
+)
+_FRAGMENT_CACHE_SIZE = 256
+_fragments = {}
+# Cached in place of output for fragments that do not fit on the current page
+_SPILLS = object()
+_report_fonts = None
+
+
+class ReportPDF(FPDF):
+    """FPDF that assembles the finished document directly into a bytearray.
+
+    Stock FPDF grows the document as a str and hands it back for a final
+    latin-1 encode, copying the whole file on every append and once more
+    at the end. Page content is still built as a str, as _putpages expects.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = bytearray()
+
+    def _out(self, s):
+        if self.state == 2:
+            super()._out(s)
+            return
+        if isinstance(s, str):
+            s = s.encode("latin-1")
+        elif not isinstance(s, (bytes, bytearray)):
+            s = str(s).encode("latin-1")
+        self.buffer += s
+        self.buffer += b"\n"
+
+    def output_bytes(self):
+        """Closes the document and returns it as bytes."""
+        if self.state < 3:
+            self.close()
+        # WSGI servers only accept bytes, so hand back one immutable copy
+        return bytes(self.buffer)
+
+
+def _new_report_pdf():
+    """Creates a one-page report document with the report fonts registered."""
+    global _report_fonts
+    if _report_fonts is None:
+        # Register fonts in the order the layout first uses them, so the
+        # font ids in cached fragments match every document.
+        pdf = FPDF()
+        for style in ('B', '', 'I'):
+            pdf.set_font("Arial", style, 12)
+        _report_fonts = pdf.fonts
+
+    pdf = ReportPDF()
+    pdf.fonts = {key: dict(font) for key, font in _report_fonts.items()}
+    pdf.add_page()
+    return pdf
+
+
+def _get_state(pdf):
+    return tuple(getattr(pdf, attr) for attr in _STATE_ATTRS)
+
+
+def _set_state(pdf, state):
+    for attr, value in zip(_STATE_ATTRS, state):
+        setattr(pdf, attr, value)
+    if pdf.font_family:
+        pdf.font_size = pdf.font_size_pt / pdf.k
+        pdf.current_font = pdf.fonts[pdf.font_family + pdf.font_style]
+        pdf.unifontsubset = pdf.current_font['type'] == 'TTF'
+
+
+def _draw_fragment(pdf, draw, *args):
+    """Draws a static part of the layout, reusing previously rendered output.
+
+    A fragment's content-stream output only depends on the page state it
+    starts from, so it is rendered once per starting state on a scratch
+    document and then appended verbatim to later reports.
+    """
+    key = (draw.__name__, args, _get_state(pdf))
+    cached = _fragments.get(key)
+    if cached is None:
+        scratch = _new_report_pdf()
+        _set_state(scratch, key[2])
+        start = len(scratch.pages[1])
+        draw(scratch, *args)
+        if scratch.page != 1:
+            cached = _SPILLS
+        else:
+            cached = (scratch.pages[1][start:], _get_state(scratch))
+        if len(_fragments) >= _FRAGMENT_CACHE_SIZE:
+            _fragments.clear()
+        _fragments[key] = cached
+
+    if cached is _SPILLS:
+        # The fragment spills onto a new page; lay it out live instead
+        draw(pdf, *args)
+        return
+
+    content, state = cached
+    pdf.pages[pdf.page] += content
+    _set_state(pdf, state)
+
+
+def _draw_title(pdf):
+    pdf.set_font("Arial", 'B', 24)
+    pdf.cell(0, 15, "Clinical Assessment Report", ln=True, align='C')
+    pdf.set_font("Arial", '', 12)
+    pdf.cell(0, 8, "Gastric Cancer Risk Estimation System", ln=True, align='C')
+
+
+def _draw_profile_box(pdf):
+    pdf.set_fill_color(245, 245, 245)
+    pdf.rect(10, pdf.get_y(), 190, 40, 'F')
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, "Risk Profile", ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", '', 12)
+
+
+def _draw_section_header(pdf, title):
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, title, ln=True)
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(5)
+
+    pdf.set_font("Arial", '', 12)
+
+
+def _draw_disclaimer(pdf):
+    pdf.ln(20)
+    pdf.set_font("Arial", 'I', 10)
+    pdf.set_text_color(100, 100, 100)
+    pdf.multi_cell(0, 5, DISCLAIMER, align='C')
+
+
+def render_report(data, timer=None):
+    """Renders one clinical assessment report.
+
+    ``data`` is a /predict result plus optional ``patient_name``. ``timer`` is
+    an optional metrics.StageTimer that records the layout and serialization
+    stages. Returns a ``(filename, pdf_bytes)`` tuple.
+    """
+    # Extract data
+    risk_level = data.get('risk_level', 'Unknown').upper()
+    probability = data.get('probability_of_cancer', 0)
+    drivers = data.get('risk_drivers', [])
+    recommendations = data.get('recommendations', [])
+    date_str = data.get('date', datetime.datetime.now().strftime("%Y-%m-%d"))
+    prob_percent = f"{float(probability) * 100:.2f}%"
+    patient_name = data.get('patient_name', 'Guest').encode('latin-1', 'replace').decode('latin-1')
+
+    # Create PDF
+    pdf = _new_report_pdf()
+
+    # Title
+    _draw_fragment(pdf, _draw_title)
+    pdf.cell(0, 8, f"Date: {date_str}", ln=True, align='C')
+    pdf.cell(0, 8, f"Patient Name: {patient_name}", ln=True, align='C')
+    pdf.ln(10)
+
+    # Risk Profile
+    _draw_fragment(pdf, _draw_profile_box)
+    current_y = pdf.get_y()
+
+    # Analysis Result
+    pdf.set_xy(30, current_y)
+    pdf.cell(60, 6, "Analysis Result", ln=True, align='C')
+    pdf.set_font("Arial", 'B', 20)
+
+    # Color logic isn't supported directly in cell text easily without multi-cell,
+    # but we can set text color.
+    if risk_level == 'HIGH':
+        pdf.set_text_color(211, 47, 47) # Red
+    elif risk_level == 'MODERATE':
+        pdf.set_text_color(239, 108, 0) # Orange
+    else:
+        pdf.set_text_color(46, 125, 50) # Green
+
+    pdf.set_xy(30, current_y + 8)
+    pdf.cell(60, 10, f"{risk_level} RISK", ln=True, align='C')
+    pdf.set_text_color(0, 0, 0) # Reset
+
+    # Probability
+    pdf.set_xy(120, current_y)
+    pdf.set_font("Arial", '', 12)
+    pdf.cell(60, 6, "Estimated Probability", ln=True, align='C')
+    pdf.set_font("Arial", 'B', 20)
+    pdf.set_xy(120, current_y + 8)
+    pdf.cell(60, 10, prob_percent, ln=True, align='C')
+
+    pdf.ln(20)
+
+    # Top Risk Drivers
+    _draw_fragment(pdf, _draw_section_header, "Top Risk Drivers")
+    if drivers:
+        for driver in drivers:
+            name = driver.get('name', '').encode('latin-1', 'replace').decode('latin-1')
+            impact = driver.get('impact', '').encode('latin-1', 'replace').decode('latin-1')
+            pdf.set_font("Arial", 'B', 12)
+            pdf.write(5, f"- {name}")
+            pdf.set_font("Arial", '', 11)
+            pdf.write(5, f" ({impact} Impact)")
+            pdf.ln(8)
+    else:
+        pdf.cell(0, 10, "No specific major risk drivers identified.", ln=True)
+
+    pdf.ln(10)
+
+    # Recommendations
+    _draw_fragment(pdf, _draw_section_header, "Recommended Next Steps")
+    if recommendations:
+        for step in recommendations:
+            step_clean = step.encode('latin-1', 'replace').decode('latin-1')
+            pdf.write(5, f"- {step_clean}")
+            pdf.ln(8)
+    else:
+        pdf.cell(0, 10, "Consult a healthcare provider.", ln=True)
+
+    # Disclaimer
+    _draw_fragment(pdf, _draw_disclaimer)
+
+    if timer:
+        timer.mark("layout")
+    pdf_bytes = pdf.output_bytes()
+    if timer:
+        timer.mark("serialize")
+
+    return f"Gastric_Risk_Report_{date_str}.pdf", pdf_bytes
+
+
+# --- Report Job Queue ---
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable sink that hands ZIP output back in chunks."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """Yields a ZIP archive of ``(name, data)`` entries one member at a time."""
+    sink = _ZipSink()
+    # PDF page streams are already deflated, so members are stored as-is
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+class ReportJobQueue:
+    """Renders submitted report batches on a background process pool.
+
+    Jobs are held in memory until they expire, so status and results are
+    only visible to the server process that accepted the submission.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._jobs = {}
+        # Reports queued, rendering or awaiting download, across all jobs
+        self._retained = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Started lazily so importing the app does not fork worker processes
+        if self._executor is None:
+            ctx = multiprocessing.get_context(REPORT_START_METHOD)
+            if REPORT_START_METHOD == "forkserver":
+                ctx.set_forkserver_preload(["reports"])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._executor
+
+    def _reset_executor(self):
+        # A worker died (e.g. OOM-killed), which breaks the whole pool; drop
+        # it so the next submission starts a fresh one
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_all(self, payloads):
+        executor = self._get_executor()
+        futures = []
+        try:
+            for payload in payloads:
+                futures.append(executor.submit(render_report, payload))
+        except BrokenProcessPool:
+            for future in futures:
+                future.cancel()
+            raise
+        return futures
+
+    def _expire(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if now - job["created"] > REPORT_JOB_TTL_SECONDS
+            and all(f.done() for f in job["futures"])
+        ]
+        for job_id in expired:
+            self._retained -= len(self._jobs.pop(job_id)["futures"])
+
+    def submit(self, payloads):
+        """Queues a list of report payloads and returns the new job id.
+
+        Raises OverflowError when too many jobs or reports are held, and
+        BrokenProcessPool when the worker pool cannot be restarted.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if len(self._jobs) >= REPORT_MAX_JOBS:
+                raise OverflowError("Too many report jobs in progress.")
+            if self._retained + len(payloads) > REPORT_MAX_RETAINED:
+                raise OverflowError("Too many reports queued or awaiting download.")
+            try:
+                futures = self._submit_all(payloads)
+            except BrokenProcessPool:
+                self._reset_executor()
+                try:
+                    futures = self._submit_all(payloads)
+                except BrokenProcessPool:
+                    self._reset_executor()
+                    raise
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {"created": now, "futures": futures}
+            self._retained += len(futures)
+        return job_id
+
+    def _get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """Returns a progress summary for ``job_id``, or None if unknown."""
+        job = self._get(job_id)
+        if job is None:
+            return None
+
+        futures = job["futures"]
+        done = [f for f in futures if f.done()]
+        errors = [
+            {"index": i, "error": str(f.exception())}
+            for i, f in enumerate(futures)
+            if f.done() and f.exception() is not None
+        ]
+        if len(done) == len(futures):
+            state = "failed" if len(errors) == len(futures) else "done"
+        elif done or any(f.running() for f in futures):
+            state = "running"
+        else:
+            state = "queued"
+
+        return {
+            "job_id": job_id,
+            "status": state,
+            "total": len(futures),
+            "completed": len(done) - len(errors),
+            "failed": len(errors),
+            "errors": errors,
+            "created": datetime.datetime.fromtimestamp(job["created"]).isoformat(),
+        }
+
+    def results(self, job_id):
+        """Returns ``(filename, pdf_bytes)`` per submitted payload, None where rendering failed."""
+        job = self._get(job_id)
+        if job is None:
+            return None
+        return [
+            f.result() if f.done() and f.exception() is None else None
+            for f in job["futures"]
+        ]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+report_jobs = ReportJobQueue()
+atexit.register(report_jobs.shutdown)